@@ -3,36 +3,170 @@ Extended examples showing real-world use cases for background tasks.
 These examples demonstrate practical applications beyond the simple sleep demo.
 """
 import asyncio
+import contextvars
+import itertools
+import os
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, BackgroundTasks
+import aiohttp
+import asyncpg
+import orjson
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Background Tasks Real-World Examples")
+# Monotonic clock plus a counter gives unique IDs without building a datetime per request
+_id_counter = itertools.count()
 
+# External services used by the background tasks. Each one is optional: when it is
+# not configured, the matching step is simulated with a sleep instead.
+EMAIL_API_URL = os.environ.get("EMAIL_API_URL")
+ANALYTICS_API_URL = os.environ.get("ANALYTICS_API_URL")
+DATABASE_DSN = os.environ.get("DATABASE_DSN")
 
-# Example 1: Email notification simulation
-async def send_email_notification(user_email: str, message: str):
-    """Simulate sending an email notification in the background."""
-    logger.info(f"Starting email send to {user_email}")
-    await asyncio.sleep(2)  # Simulate email API call
-    logger.info(f"Email sent to {user_email}: {message}")
+# Caps how long a slow external API can hold one of the shared workers
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+UPLOADED_FILES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploaded_files (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    processed BOOLEAN NOT NULL DEFAULT FALSE
+)
+"""
+
+# Advisory lock key shared by every worker process creating the schema
+SCHEMA_LOCK_KEY = 7201
+
+
+async def _create_schema(pool: asyncpg.Pool):
+    """
+    Create the uploaded_files table if it is missing.
+    Every uvicorn worker process runs this at startup, and concurrent
+    CREATE TABLE IF NOT EXISTS can still collide in pg_type, so creation is
+    serialized with an advisory lock. A unique violation from a creator outside
+    the lock means the table now exists.
+    """
+    async with pool.acquire() as conn:
+        try:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_KEY)
+                await conn.execute(UPLOADED_FILES_SCHEMA)
+        except asyncpg.UniqueViolationError:
+            pass
+
+# Background work is handed to a fixed pool of workers draining a bounded queue,
+# so request handlers never carry the task themselves and bursts get back-pressure
+NUM_WORKERS = 32
+QUEUE_MAXSIZE = 10_000
+
+
+async def enqueue(func, *args):
+    """
+    Queue a background task for the worker pool.
+    The caller's context is captured with the task so it runs under the request's
+    trace context (which SkyWalking keeps in contextvars) rather than the lifespan's.
+    """
+    await app.state.task_queue.put((func, args, contextvars.copy_context()))
+
+
+async def _worker(queue: asyncio.Queue):
+    """Run queued background tasks one at a time until cancelled."""
+    while True:
+        func, args, ctx = await queue.get()
+        try:
+            await asyncio.create_task(func(*args), context=ctx)
+        except Exception:
+            logger.exception("Background task %s failed", func.__name__)
+        finally:
+            queue.task_done()
+
+
+def _on_worker_done(worker: asyncio.Task):
+    """Log a worker that stopped for any reason other than shutdown."""
+    if not worker.cancelled() and worker.exception() is not None:
+        logger.error("Background worker died", exc_info=worker.exception())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open pooled HTTP and database connections for the configured services,
+    then start the worker pool. Background tasks reuse these pools instead of
+    connecting per task; the exit stack closes whichever were opened.
+    """
+    async with AsyncExitStack() as stack:
+        app.state.http = None
+        if EMAIL_API_URL or ANALYTICS_API_URL:
+            app.state.http = await stack.enter_async_context(aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60),
+                timeout=HTTP_TIMEOUT
+            ))
+        app.state.db = None
+        if DATABASE_DSN:
+            app.state.db = await stack.enter_async_context(
+                asyncpg.create_pool(DATABASE_DSN, min_size=4, max_size=32)
+            )
+            await _create_schema(app.state.db)
+        # Created here rather than at import so the queue belongs to the running loop
+        queue = asyncio.Queue(maxsize=QUEUE_MAXSIZE)
+        app.state.task_queue = queue
+        workers = [asyncio.create_task(_worker(queue)) for _ in range(NUM_WORKERS)]
+        for worker in workers:
+            worker.add_done_callback(_on_worker_done)
+        try:
+            yield
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Cache warms run outside the worker pool, so stop any still in flight
+            warms = list(_inflight.values())
+            for warm in warms:
+                warm.cancel()
+            await asyncio.gather(*warms, return_exceptions=True)
+
+
+app = FastAPI(
+    title="Background Tasks Real-World Examples",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
+
+# Example 1: Email notification
+async def send_email_notification(app: FastAPI, user_email: str, message: str):
+    """Send an email notification through the email API in the background."""
+    logger.info("Starting email send to %s", user_email)
+    if EMAIL_API_URL is None:
+        await asyncio.sleep(2)  # Simulate email API call
+    else:
+        async with app.state.http.post(
+            EMAIL_API_URL, json={"to": user_email, "message": message}
+        ) as response:
+            response.raise_for_status()
+    logger.info("Email sent to %s: %s", user_email, message)
 
 
 @app.post("/register")
-async def register_user(email: str, background_tasks: BackgroundTasks):
+async def register_user(email: str):
     """
     User registration endpoint that sends welcome email in background.
     Returns immediately after registration, email sent asynchronously.
     """
     # Register user (fast operation)
-    user_id = f"user-{datetime.now().timestamp()}"
+    user_id = f"user-{time.monotonic_ns()}-{next(_id_counter)}"
     
     # Schedule email to be sent in background
-    background_tasks.add_task(
+    await enqueue(
         send_email_notification,
+        app,
         email,
         "Welcome to our service!"
     )
@@ -45,34 +179,61 @@ async def register_user(email: str, background_tasks: BackgroundTasks):
     }
 
 
-# Example 2: Data processing simulation
-async def process_uploaded_file(file_id: str, file_size: int):
-    """Simulate processing an uploaded file."""
-    logger.info(f"Starting processing for file {file_id} ({file_size} bytes)")
-    
-    # Simulate various processing steps
-    await asyncio.sleep(1)  # Extract metadata
-    logger.info(f"[{file_id}] Metadata extracted")
+# Example 2: Data processing
+async def extract_metadata(file_id: str):
+    """Simulate extracting metadata from an uploaded file."""
+    await asyncio.sleep(1)
+    logger.info("[%s] Metadata extracted", file_id)
+
+
+async def generate_thumbnails(file_id: str):
+    """Simulate generating thumbnails for an uploaded file."""
+    await asyncio.sleep(2)
+    logger.info("[%s] Thumbnails generated", file_id)
+
+
+async def update_db(app: FastAPI, file_id: str, filename: str, file_size: int):
+    """Record the uploaded file as processed in the database."""
+    if app.state.db is None:
+        await asyncio.sleep(1)  # Simulate database update
+    else:
+        await app.state.db.execute(
+            """
+            INSERT INTO uploaded_files (id, filename, size, processed)
+            VALUES ($1, $2, $3, TRUE)
+            ON CONFLICT (id) DO UPDATE SET processed = TRUE
+            """,
+            file_id, filename, file_size
+        )
+    logger.info("[%s] Database updated", file_id)
+
+
+async def process_uploaded_file(app: FastAPI, file_id: str, filename: str, file_size: int):
+    """Process an uploaded file."""
+    logger.info("Starting processing for file %s (%s bytes)", file_id, file_size)
     
-    await asyncio.sleep(2)  # Generate thumbnails
-    logger.info(f"[{file_id}] Thumbnails generated")
+    # Metadata and thumbnails are independent; only the database update needs both.
+    # A failure in either step cancels the other instead of leaving it running.
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(extract_metadata(file_id))
+        tg.create_task(generate_thumbnails(file_id))
     
-    await asyncio.sleep(1)  # Update database
-    logger.info(f"[{file_id}] Database updated")
+    await update_db(app, file_id, filename, file_size)
     
-    logger.info(f"[{file_id}] Processing complete")
+    logger.info("[%s] Processing complete", file_id)
 
 
 @app.post("/upload")
-async def upload_file(filename: str, size: int, background_tasks: BackgroundTasks):
+async def upload_file(filename: str, size: int):
     """
     File upload endpoint that processes file in background.
     Returns upload confirmation immediately, processing happens asynchronously.
     """
-    file_id = f"file-{datetime.now().timestamp()}"
+    # File IDs are stored in the database, so they must stay unique across restarts
+    file_id = f"file-{uuid.uuid4()}"
     
     # Schedule background processing
-    background_tasks.add_task(process_uploaded_file, file_id, size)
+    await enqueue(process_uploaded_file, app, file_id, filename, size)
     
     return {
         "file_id": file_id,
@@ -84,25 +245,36 @@ async def upload_file(filename: str, size: int, background_tasks: BackgroundTask
 
 
 # Example 3: Analytics logging
-async def log_analytics_event(event_type: str, user_id: str, data: dict):
+async def log_analytics_event(app: FastAPI, event_type: str, user_id: str, data: dict):
     """Log analytics event to external service."""
-    logger.info(f"Logging analytics: {event_type} for user {user_id}")
-    await asyncio.sleep(0.5)  # Simulate API call to analytics service
-    logger.info(f"Analytics logged: {event_type}")
+    if "timestamp" in data:
+        # Handlers record a cheap epoch float; format it here, off the request path
+        data = {**data, "timestamp": datetime.fromtimestamp(data["timestamp"]).isoformat()}
+    logger.info("Logging analytics: %s for user %s", event_type, user_id)
+    if ANALYTICS_API_URL is None:
+        await asyncio.sleep(0.5)  # Simulate API call to analytics service
+    else:
+        async with app.state.http.post(
+            ANALYTICS_API_URL,
+            json={"event_type": event_type, "user_id": user_id, "data": data}
+        ) as response:
+            response.raise_for_status()
+    logger.info("Analytics logged: %s", event_type)
 
 
 @app.get("/product/{product_id}")
-async def view_product(product_id: str, user_id: str, background_tasks: BackgroundTasks):
+async def view_product(product_id: str, user_id: str):
     """
     Product view endpoint that logs analytics in background.
     Returns product data immediately, analytics logged asynchronously.
     """
     # Schedule analytics logging
-    background_tasks.add_task(
+    await enqueue(
         log_analytics_event,
+        app,
         "product_view",
         user_id,
-        {"product_id": product_id, "timestamp": datetime.now().isoformat()}
+        {"product_id": product_id, "timestamp": time.time()}
     )
     
     # Return product data immediately
@@ -117,60 +289,75 @@ async def view_product(product_id: str, user_id: str, background_tasks: Backgrou
 # Example 4: Cache warming
 async def warm_cache(cache_key: str, expensive_operation: str):
     """Simulate warming a cache with expensive computation."""
-    logger.info(f"Starting cache warm for {cache_key}")
+    logger.info("Starting cache warm for %s", cache_key)
     await asyncio.sleep(3)  # Simulate expensive computation
-    logger.info(f"Cache warmed for {cache_key}: {expensive_operation}")
+    logger.info("Cache warmed for %s: %s", cache_key, expensive_operation)
+
+
+# In-flight warms keyed by cache key, so repeated invalidations share one warm
+_inflight: dict[str, asyncio.Task] = {}
+
+
+def _on_warm_done(cache_key: str, task: asyncio.Task):
+    """Forget a finished warm and log its failure, if any."""
+    if _inflight.get(cache_key) is task:
+        del _inflight[cache_key]
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Cache warm for %s failed", cache_key, exc_info=task.exception())
 
 
 @app.post("/invalidate-cache")
-async def invalidate_cache(cache_key: str, background_tasks: BackgroundTasks):
+async def invalidate_cache(cache_key: str):
     """
     Cache invalidation endpoint that warms cache in background.
     Returns immediately, cache rebuilt asynchronously.
+    Invalidations arriving while a warm for the same key is running reuse it.
     """
-    # Schedule cache warming
-    background_tasks.add_task(
-        warm_cache,
-        cache_key,
-        "expensive_computation_result"
-    )
+    task = _inflight.get(cache_key)
+    coalesced = task is not None and not task.done()
+    if not coalesced:
+        task = asyncio.create_task(warm_cache(cache_key, "expensive_computation_result"))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda t: _on_warm_done(cache_key, t))
     
     return {
         "cache_key": cache_key,
         "status": "invalidated",
-        "note": "Cache is being warmed in the background"
+        "note": "Cache warm already in progress" if coalesced else "Cache is being warmed in the background"
     }
 
 
 # Example 5: Multiple background tasks
+async def run_concurrently(*jobs):
+    """
+    Run several independent (func, args) jobs at once from a single queue slot.
+    They finish in max(durations) rather than their sum, even when only one worker
+    is free, and one failing job does not stop the others.
+    """
+    results = await asyncio.gather(
+        *(func(*args) for func, args in jobs),
+        return_exceptions=True
+    )
+    for (func, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.error("Background task %s failed", func.__name__, exc_info=result)
+
+
 @app.post("/complete-order")
 async def complete_order(
     order_id: str,
-    user_email: str,
-    background_tasks: BackgroundTasks
+    user_email: str
 ):
     """
     Order completion that triggers multiple background tasks.
-    Demonstrates running multiple tasks for a single endpoint.
+    Demonstrates running multiple tasks for a single endpoint concurrently.
     """
-    # Schedule multiple background tasks
-    background_tasks.add_task(
-        send_email_notification,
-        user_email,
-        f"Order {order_id} confirmed!"
-    )
-    
-    background_tasks.add_task(
-        log_analytics_event,
-        "order_completed",
-        user_email,
-        {"order_id": order_id}
-    )
-    
-    background_tasks.add_task(
-        warm_cache,
-        f"user-orders-{user_email}",
-        "fetch_user_order_history"
+    # Schedule multiple background tasks as one queued job
+    await enqueue(
+        run_concurrently,
+        (send_email_notification, (app, user_email, f"Order {order_id} confirmed!")),
+        (log_analytics_event, (app, "order_completed", user_email, {"order_id": order_id})),
+        (warm_cache, (f"user-orders-{user_email}", "fetch_user_order_history"))
     )
     
     return {
@@ -180,22 +367,35 @@ async def complete_order(
     }
 
 
+# The root response never changes, so serialize it once at import time
+_ROOT_BYTES = orjson.dumps({
+    "message": "Background Tasks Real-World Examples",
+    "endpoints": {
+        "POST /register": "User registration with email notification",
+        "POST /upload": "File upload with background processing",
+        "GET /product/{product_id}": "Product view with analytics logging",
+        "POST /invalidate-cache": "Cache invalidation with warming",
+        "POST /complete-order": "Order completion with multiple tasks"
+    },
+    "note": "All endpoints return immediately while tasks run in background"
+})
+
+
 @app.get("/")
-def root():
+async def root():
     """List all available example endpoints."""
-    return {
-        "message": "Background Tasks Real-World Examples",
-        "endpoints": {
-            "POST /register": "User registration with email notification",
-            "POST /upload": "File upload with background processing",
-            "GET /product/{product_id}": "Product view with analytics logging",
-            "POST /invalidate-cache": "Cache invalidation with warming",
-            "POST /complete-order": "Order completion with multiple tasks"
-        },
-        "note": "All endpoints return immediately while tasks run in background"
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Multiple worker processes need an import string; each runs its own worker pool and queue.
+    # os.cpu_count() sees the host's cores inside a container, so set WEB_CONCURRENCY there.
+    uvicorn.run(
+        "examples:app",
+        host="0.0.0.0",
+        port=8001,
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 4)),
+        loop="auto",
+        http="httptools"
+    )
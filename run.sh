@@ -9,5 +9,9 @@ export SW_AGENT_COLLECTOR_BACKEND_SERVICES=127.0.0.1:11800
 export SW_AGENT_PROTOCOL=grpc
 export SW_AGENT_LOGGING_LEVEL=INFO
 
-# Start the application with SkyWalking agent
-sw-python run -p main:app uvicorn main:app --host 0.0.0.0 --port 8000
+# Number of uvicorn worker processes (defaults to the visible CPU count)
+WORKERS=${WEB_CONCURRENCY:-$(nproc)}
+
+# Start the application with SkyWalking agent (-p enables prefork support for multiple workers)
+sw-python run -p main:app uvicorn main:app --host 0.0.0.0 --port 8000 \
+    --workers "$WORKERS" --loop auto --http httptools
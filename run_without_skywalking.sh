@@ -2,5 +2,6 @@
 
 # Run the FastAPI application WITHOUT SkyWalking agent
 # Useful for local development and testing
+# Runs a single worker: --reload cannot be combined with --workers
 
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+uvicorn main:app --host 0.0.0.0 --port 8000 --loop auto --http httptools --reload
@@ -0,0 +1,138 @@
+"""
+Test script for the background task machinery in examples.py.
+Checks that queued jobs run in the context of the request that queued them,
+that a failed file processing step cancels its sibling,
+that repeated invalidations of a key share one in-flight warm,
+and that a new warm starts once the previous one has finished.
+"""
+import asyncio
+import contextvars
+
+import examples
+
+
+async def check_request_context_reaches_queued_job():
+    """
+    A ContextVar set by the handler must be visible inside the queued job,
+    even though the worker running it was started from lifespan.
+    """
+    request_id = contextvars.ContextVar("request_id", default="lifespan")
+    seen = []
+    done = asyncio.Event()
+
+    async def job():
+        seen.append(request_id.get())
+        done.set()
+
+    async def handler():
+        request_id.set("request-1")
+        await examples.enqueue(job)
+
+    # Keep lifespan from opening connections to external services
+    services = (examples.EMAIL_API_URL, examples.ANALYTICS_API_URL, examples.DATABASE_DSN)
+    examples.EMAIL_API_URL = examples.ANALYTICS_API_URL = examples.DATABASE_DSN = None
+    try:
+        async with examples.lifespan(examples.app):
+            await asyncio.create_task(handler())
+            await asyncio.wait_for(done.wait(), timeout=1)
+    finally:
+        examples.EMAIL_API_URL, examples.ANALYTICS_API_URL, examples.DATABASE_DSN = services
+    assert seen == ["request-1"]
+
+
+async def check_failed_step_cancels_sibling():
+    """
+    If metadata extraction fails, thumbnail generation must be cancelled
+    rather than left running after process_uploaded_file has given up.
+    """
+    thumbnails_cancelled = asyncio.Event()
+
+    async def failing_extract_metadata(file_id: str):
+        await asyncio.sleep(0)
+        raise RuntimeError("metadata extraction failed")
+
+    async def slow_generate_thumbnails(file_id: str):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            thumbnails_cancelled.set()
+            raise
+
+    original_steps = (examples.extract_metadata, examples.generate_thumbnails)
+    examples.extract_metadata = failing_extract_metadata
+    examples.generate_thumbnails = slow_generate_thumbnails
+    try:
+        await examples.process_uploaded_file(examples.app, "file-test", "test.png", 0)
+    except* RuntimeError:
+        pass
+    else:
+        raise AssertionError("metadata failure was not propagated")
+    finally:
+        examples.extract_metadata, examples.generate_thumbnails = original_steps
+    assert thumbnails_cancelled.is_set()
+
+
+async def check_cache_warm_coalescing():
+    """
+    Drive /invalidate-cache directly with a warm that only finishes when released.
+    """
+    started = []
+    release = asyncio.Event()
+
+    async def fake_warm_cache(cache_key: str, expensive_operation: str):
+        started.append(cache_key)
+        await release.wait()
+
+    original_warm_cache = examples.warm_cache
+    examples.warm_cache = fake_warm_cache
+    try:
+        # Two back-to-back invalidations of the same key share one warm
+        await examples.invalidate_cache("products")
+        first_warm = examples._inflight["products"]
+        await examples.invalidate_cache("products")
+        await asyncio.sleep(0)
+        assert examples._inflight["products"] is first_warm
+        assert started == ["products"]
+
+        # Once the warm finishes it is forgotten
+        release.set()
+        await first_warm
+        await asyncio.sleep(0)
+        assert "products" not in examples._inflight
+
+        # The next invalidation starts a fresh warm
+        release.clear()
+        await examples.invalidate_cache("products")
+        second_warm = examples._inflight["products"]
+        await asyncio.sleep(0)
+        assert second_warm is not first_warm
+        assert started == ["products", "products"]
+
+        release.set()
+        await second_warm
+    finally:
+        examples.warm_cache = original_warm_cache
+        examples._inflight.clear()
+
+
+def test_request_context_reaches_queued_job():
+    asyncio.run(check_request_context_reaches_queued_job())
+
+
+def test_failed_step_cancels_sibling():
+    asyncio.run(check_failed_step_cancels_sibling())
+
+
+def test_cache_warm_coalescing():
+    asyncio.run(check_cache_warm_coalescing())
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("Testing Background Task Machinery")
+    print("=" * 70)
+    test_request_context_reaches_queued_job()
+    test_failed_step_cancels_sibling()
+    test_cache_warm_coalescing()
+    print("Test completed successfully!")
+    print("=" * 70)